@@ -1,6 +1,9 @@
+import hashlib
 import json
+import os
 import random
-from collections import defaultdict
+
+import orjson
 
 # --- Step 1: Convert from original {"Context": "...", "Response": "..."} to the correct Gemini Fine-tune format ---
 def convert_to_gemini_finetune_correct_format(input_jsonl_path, output_jsonl_path, system_instruction_text):
@@ -63,20 +66,25 @@ def split_finetune_data(input_jsonl_path, train_output_path, validation_output_p
         input_jsonl_path (str): Path to the input JSONL file in Gemini fine-tune format.
         train_output_path (str): Path where the training JSONL file will be saved.
         validation_output_path (str): Path where the validation JSONL file will be saved.
-        split_ratio (float): The proportion of unique contexts to allocate to the training set.
+        split_ratio (float): The expected proportion of unique contexts to allocate to the training set.
     """
     if not (0 < split_ratio < 1):
         raise ValueError("split_ratio must be between 0 and 1 (exclusive).")
 
-    grouped_data = defaultdict(list)
+    # Each example is routed by a hash of its first user message, so every copy of a
+    # context lands on the same side and lines stream straight through without a shuffle
+    threshold = int(split_ratio * 2**64)
     unique_contexts = set()
-    total_examples = 0
+    train_count = 0
+    validation_count = 0
 
-    with open(input_jsonl_path, 'r', encoding='utf-8') as infile:
+    with open(input_jsonl_path, 'rb') as infile, \
+            open(train_output_path, 'wb') as train_file, \
+            open(validation_output_path, 'wb') as validation_file:
         for line_num, line in enumerate(infile, 1):
             try:
-                example = json.loads(line)
-                
+                example = orjson.loads(line)
+
                 # Extract user message from the 'contents' field
                 user_message_content = None
                 if "contents" in example and isinstance(example["contents"], list):
@@ -90,49 +98,36 @@ def split_finetune_data(input_jsonl_path, train_output_path, validation_output_p
                             break # Found the first user message, break outer loop
 
                 if not user_message_content:
-                    print(f"Warning: Skipping line {line_num} due to missing or malformed user message in 'contents': {line.strip()}")
+                    print(f"Warning: Skipping line {line_num} due to missing or malformed user message in 'contents': {line.decode('utf-8', 'replace').strip()}")
                     continue
 
-                grouped_data[user_message_content].append(example)
-                unique_contexts.add(user_message_content)
-                total_examples += 1
-
-            except json.JSONDecodeError as e:
-                print(f"Error decoding JSON on line {line_num}: {line.strip()} - {e}")
+                digest = hashlib.blake2b(user_message_content.encode('utf-8'), digest_size=8).digest()
+                if not line.endswith(b'\n'):
+                    line += b'\n'
+                if int.from_bytes(digest, 'big') < threshold:
+                    train_file.write(line)
+                    train_count += 1
+                else:
+                    validation_file.write(line)
+                    validation_count += 1
+                unique_contexts.add(digest)
+
+            except orjson.JSONDecodeError as e:
+                print(f"Error decoding JSON on line {line_num}: {line.decode('utf-8', 'replace').strip()} - {e}")
             except Exception as e:
-                print(f"An unexpected error occurred on line {line_num}: {line.strip()} - {e}")
+                print(f"An unexpected error occurred on line {line_num}: {line.decode('utf-8', 'replace').strip()} - {e}")
 
-    print(f"Read {total_examples} examples, with {len(unique_contexts)} unique user contexts.")
+    print(f"Read {train_count + validation_count} examples, with {len(unique_contexts)} unique user contexts.")
 
     if not unique_contexts:
+        # Nothing was written; don't leave empty split files behind
+        os.remove(train_output_path)
+        os.remove(validation_output_path)
         print("No valid data found to split. Exiting.")
         return
 
-    shuffled_contexts = list(unique_contexts)
-    random.shuffle(shuffled_contexts)
-
-    split_idx = int(len(shuffled_contexts) * split_ratio)
-    train_contexts = set(shuffled_contexts[:split_idx])
-    validation_contexts = set(shuffled_contexts[split_idx:])
-
-    train_data = []
-    validation_data = []
-
-    for context, examples in grouped_data.items():
-        if context in train_contexts:
-            train_data.extend(examples)
-        elif context in validation_contexts:
-            validation_data.extend(examples)
-
-    with open(train_output_path, 'w', encoding='utf-8') as outfile:
-        for entry in train_data:
-            outfile.write(json.dumps(entry, ensure_ascii=False) + '\n')
-    print(f"Training data saved to: {train_output_path} ({len(train_data)} examples)")
-
-    with open(validation_output_path, 'w', encoding='utf-8') as outfile:
-        for entry in validation_data:
-            outfile.write(json.dumps(entry, ensure_ascii=False) + '\n')
-    print(f"Validation data saved to: {validation_output_path} ({len(validation_data)} examples)")
+    print(f"Training data saved to: {train_output_path} ({train_count} examples)")
+    print(f"Validation data saved to: {validation_output_path} ({validation_count} examples)")
 
 # --- Step 3: Create a smaller training set (randomly picked 100 examples) ---
 def create_random_small_training_set(input_train_jsonl_path, output_small_train_jsonl_path, num_examples=100):
@@ -1,17 +1,24 @@
-import json 
+import orjson
 input_file = "finetuning_dataset_with_tools_complete.jsonl"
 output_file = "finetuning_dataset_with_tools_formatted_complete.jsonl"
 
-with open(input_file, "r", encoding="utf-8") as infile, open(output_file, "w", encoding="utf-8") as outfile:
-    buffer = ""
+with open(input_file, "rb") as infile, open(output_file, "wb") as outfile:
+    buffer = b""
     for line in infile:
-        buffer += line.strip()
+        line = line.strip()
+        single_line = not buffer
+        buffer += line
         # detect end of a JSON object (naively assuming each object ends with '}')
-        if line.strip().endswith("}"):
+        if line.endswith(b"}"):
             try:
-                obj = json.loads(buffer)
-                outfile.write(json.dumps(obj, ensure_ascii=False) + "\n")
-                buffer = ""
-            except json.JSONDecodeError:
+                obj = orjson.loads(buffer)
+            except orjson.JSONDecodeError:
                 # keep buffering if not yet a full JSON
-                buffer += " "
+                buffer += b" "
+                continue
+            # an object that already fits on one line is valid JSONL as-is
+            if single_line:
+                outfile.write(line + b"\n")
+            else:
+                outfile.write(orjson.dumps(obj, option=orjson.OPT_APPEND_NEWLINE))
+            buffer = b""
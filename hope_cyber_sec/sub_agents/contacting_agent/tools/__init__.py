@@ -0,0 +1,13 @@
+from twilio.rest import Client
+
+# One client per credential pair, shared by the send and receive tools; its pooled
+# HTTP session keeps the connection to Twilio alive across calls
+twilio_clients = {}
+
+
+def get_twilio_client(account_sid, auth_token):
+    client = twilio_clients.get((account_sid, auth_token))
+    if client is None:
+        client = twilio_clients[(account_sid, auth_token)] = Client(account_sid, auth_token)
+        print("✅ Twilio client initialized successfully.")
+    return client
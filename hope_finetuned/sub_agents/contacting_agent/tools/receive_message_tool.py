@@ -1,8 +1,9 @@
 import os
 from dotenv import load_dotenv
-from twilio.rest import Client
 from twilio.base.exceptions import TwilioRestException
 
+from . import get_twilio_client
+
 load_dotenv()
 
 def receive_message_tool() -> str:
@@ -25,8 +26,7 @@ def receive_message_tool() -> str:
             print("Please add TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN, and TWILIO_PHONE_NUMBER to your .env file.")
 
         try:
-            client = Client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
-            print("✅ Twilio client initialized successfully.")
+            client = get_twilio_client(TWILIO_ACCOUNT_SID, TWILIO_AUTH_TOKEN)
         except Exception as e:
             client = None
             print(f"❌ Failed to initialize Twilio client: {e}")
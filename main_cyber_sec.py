@@ -1,6 +1,7 @@
 import asyncio
 import uuid
 import os
+import secrets
 from dotenv import load_dotenv
 
 from google.adk.runners import Runner
@@ -31,12 +32,19 @@ os.environ["GOOGLE_GENAI_USE_VERTEXAI"] = "TRUE"
 os.environ["GOOGLE_CLOUD_PROJECT"] = PROJECT_ID
 os.environ["GOOGLE_CLOUD_LOCATION"] = LOCATION
 
-USER_ID = f"user_{uuid.uuid4()}"
+USER_ID = "user_" + secrets.token_hex(16)
+
+# Number of recalled memories formatted into the agent's context
+MEMORY_TOP_K = 10
+
+
+def user_content(text):
+    # model_construct skips pydantic validation of fields we set ourselves
+    return types.Content.model_construct(role="user", parts=[types.Part.model_construct(text=text)])
 
 
 def run_single_turn(query, runner, session, user_id):
-    content = types.Content(role="user", parts=[types.Part(text=query)])
-    events = runner.run(user_id=user_id, session_id=session, new_message=content)
+    events = runner.run(user_id=user_id, session_id=session, new_message=user_content(query))
 
     response_content = None
     for event in events:
@@ -110,7 +118,7 @@ async def main():
         if memories:
             # Format memories into a readable string for the LLM
             # You can customize this formatting
-            formatted_memories = "\n".join([f"- {m.content.parts[0].text}" for m in memories.memories if m.content and m.content.parts])
+            formatted_memories = "\n".join(f"- {m.content.parts[0].text}" for m in memories.memories[:MEMORY_TOP_K] if m.content and m.content.parts)
             return f"Retrieved relevant past memories:\n{formatted_memories}"
         return "No relevant past memories found."
 
@@ -141,19 +149,24 @@ async def main():
     )
     chat_loop(session1.id, runner, USER_ID)
 
-    completed_session = await runner.session_service.get_session(
-        app_name=app_name, user_id=USER_ID, session_id=session1.id
-    )
+    async def add_session_to_memory_bank(session_id):
+        completed_session = await runner.session_service.get_session(
+            app_name=app_name, user_id=USER_ID, session_id=session_id
+        )
+        await memory_bank_service.add_session_to_memory(completed_session)
+        print("Session added to memory.")
 
+    # Session 2 is created while session 1 is ingested, but its chat only starts once ingestion is done
     print("\n--- Adding Session 1 to Memory Bank ---")
-    await memory_bank_service.add_session_to_memory(completed_session)
-    print("Session added to memory.")
+    session2, _ = await asyncio.gather(
+        runner.session_service.create_session(
+            app_name=app_name, # Use app_name for consistency
+            user_id=USER_ID,
+        ),
+        add_session_to_memory_bank(session1.id),
+    )
 
     print("\n--- Starting Second Session (Memory Recall) ---")
-    session2 = await runner.session_service.create_session(
-        app_name=app_name, # Use app_name for consistency
-        user_id=USER_ID,
-    )
     chat_loop(session2.id, runner, USER_ID)
 
     delete_engine = True
@@ -1,7 +1,9 @@
 import asyncio
 import uuid
 import os
+import secrets
 from dotenv import load_dotenv
+from cachetools import TTLCache
 
 from google.adk.runners import Runner
 from google.genai import types
@@ -31,12 +33,27 @@ os.environ["GOOGLE_GENAI_USE_VERTEXAI"] = "TRUE"
 os.environ["GOOGLE_CLOUD_PROJECT"] = PROJECT_ID
 os.environ["GOOGLE_CLOUD_LOCATION"] = LOCATION
 
-USER_ID = f"user_{uuid.uuid4()}"
+USER_ID = "user_" + secrets.token_hex(16)
+
+# Number of recalled memories formatted into the agent's context
+MEMORY_TOP_K = 10
+
+# Recently recalled memories, keyed by (user_id, normalized query)
+memory_cache = TTLCache(maxsize=1024, ttl=300)
+
+
+def invalidate_memory_cache(user_id):
+    for key in [k for k in memory_cache.keys() if k[0] == user_id]:
+        memory_cache.pop(key, None)
+
+
+def user_content(text):
+    # model_construct skips pydantic validation of fields we set ourselves
+    return types.Content.model_construct(role="user", parts=[types.Part.model_construct(text=text)])
 
 
 def run_single_turn(query, runner, session, user_id):
-    content = types.Content(role="user", parts=[types.Part(text=query)])
-    events = runner.run(user_id=user_id, session_id=session, new_message=content)
+    events = runner.run(user_id=user_id, session_id=session, new_message=user_content(query))
 
     response_content = None
     for event in events:
@@ -106,15 +123,24 @@ async def main():
     # This asynchronous function will be wrapped by adk.tools.Tool
     async def recall_past_memories(query: str) -> str:
         print(f"\n[Tool Call] Calling 'recall_past_memories' with query: '{query}'")
+        cache_key = (USER_ID, " ".join(query.lower().split()))
+        cached = memory_cache.get(cache_key)
+        if cached is not None:
+            print("Using cached memories for this query.")
+            return cached
+
         memories = await memory_bank_service.search_memory(app_name=app_name,user_id=USER_ID, query=query)
         if memories:
             # Format memories into a readable string for the LLM
             # You can customize this formatting
-            formatted_memories = "\n".join([f"- {m.content.parts[0].text}" for m in memories.memories if m.content and m.content.parts])
-            if formatted_memories == "":
-                return "No relevant past memories found."
-            print("Formatted Memories:\n", formatted_memories)
-            return f"The user in previous conversations had mentioned:\n{formatted_memories}"
+            formatted_memories = "\n".join(f"- {m.content.parts[0].text}" for m in memories.memories[:MEMORY_TOP_K] if m.content and m.content.parts)
+            if formatted_memories != "":
+                print("Formatted Memories:\n", formatted_memories)
+                result = f"The user in previous conversations had mentioned:\n{formatted_memories}"
+                memory_cache[cache_key] = result
+                return result
+
+        # Not cached: memory generation runs in the background and may not have finished yet
         return "No relevant past memories found."
 
 
@@ -144,19 +170,25 @@ async def main():
     )
     chat_loop(session1.id, runner, USER_ID)
 
-    completed_session = await runner.session_service.get_session(
-        app_name=app_name, user_id=USER_ID, session_id=session1.id
-    )
+    async def add_session_to_memory_bank(session_id):
+        completed_session = await runner.session_service.get_session(
+            app_name=app_name, user_id=USER_ID, session_id=session_id
+        )
+        await memory_bank_service.add_session_to_memory(completed_session)
+        invalidate_memory_cache(USER_ID)
+        print("Session added to memory.")
 
+    # Session 2 is created while session 1 is ingested, but its chat only starts once ingestion is done
     print("\n--- Adding Session 1 to Memory Bank ---")
-    await memory_bank_service.add_session_to_memory(completed_session)
-    print("Session added to memory.")
+    session2, _ = await asyncio.gather(
+        runner.session_service.create_session(
+            app_name=app_name, # Use app_name for consistency
+            user_id=USER_ID,
+        ),
+        add_session_to_memory_bank(session1.id),
+    )
 
     print("\n--- Starting Second Session (Memory Recall) ---")
-    session2 = await runner.session_service.create_session(
-        app_name=app_name, # Use app_name for consistency
-        user_id=USER_ID,
-    )
     chat_loop(session2.id, runner, USER_ID)
 
     delete_engine = True
@@ -1,17 +1,27 @@
 import asyncio
-import uuid
+import hashlib
+import logging
 import os
-import json
+import secrets
+import mmap
+import httpx
+import orjson
+import struct
+import subprocess
 import tempfile
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
+from dataclasses import dataclass, field
 from datetime import datetime
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple, Union
 from pathlib import Path
 
 from fastapi import FastAPI, HTTPException, BackgroundTasks, UploadFile, File, Form
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import ORJSONResponse
 
 from pydantic import BaseModel, Field
+from cachetools import LRUCache, TTLCache
 from contextlib import asynccontextmanager
 
 from google.adk.runners import Runner
@@ -23,9 +33,17 @@ from google.adk.memory import VertexAiMemoryBankService
 from google.adk.sessions import VertexAiSessionService
 from google.adk.tools.agent_tool import AgentTool
 
+import numpy as np
+import soxr
+
 # Import speech recognition
 import speech_recognition as sr
-from pydub import AudioSegment
+from google.api_core.exceptions import GoogleAPIError, PermissionDenied, Unauthenticated
+try:
+    from google.cloud import speech
+except ImportError:
+    # Without google-cloud-speech every transcription goes through recognize_google
+    speech = None
 
 from hope_finetuned import root_agent
 from hope_finetuned.sub_agents.contacting_agent import contacting_agent
@@ -45,39 +63,247 @@ os.environ["GOOGLE_GENAI_USE_VERTEXAI"] = "TRUE"
 os.environ["GOOGLE_CLOUD_PROJECT"] = PROJECT_ID
 os.environ["GOOGLE_CLOUD_LOCATION"] = LOCATION
 
+# Per-request diagnostics go through logging at debug level; startup messages stay as prints
+logger = logging.getLogger(__name__)
+
 # === PERSISTENT CONFIGURATION ===
 PERSISTENCE_FILE = "agent_state.json"
+PERSISTENCE_LOG = "agent_state.log"
 APP_NAME = "hope_agent_api"
 
+# PCM format handed to the speech recognizer
+STT_SAMPLE_RATE = 16000
+STT_SAMPLE_WIDTH = 2
+UPLOAD_CHUNK_SIZE = 64 * 1024
+MAX_UPLOAD_BYTES = 25 * 1024 * 1024
+MAX_AUDIO_SECONDS = 300  # Cloud Speech streaming recognition limit
+MMAP_THRESHOLD = 2 * 1024 * 1024
+FFMPEG_BINARY = "ffmpeg"
+
+# Cloud Speech streaming: audio is sent in 100 ms frames
+STT_CHUNK_BYTES = STT_SAMPLE_RATE * STT_SAMPLE_WIDTH // 10
+STT_STREAMING_CONFIG = speech.StreamingRecognitionConfig(
+    config=speech.RecognitionConfig(
+        encoding=speech.RecognitionConfig.AudioEncoding.LINEAR16,
+        sample_rate_hertz=STT_SAMPLE_RATE,
+        language_code="en-US",
+    )
+) if speech else None
+
+# Bytes-like audio buffers: small WAV data chunks are passed around as zero-copy memoryviews
+PcmBuffer = Union[bytes, memoryview]
+
+# Leading magic bytes of supported containers, mapped to the ffmpeg format name.
+# None means "audio, but let ffmpeg probe": an ID3 tag can precede MP3 as well as other streams
+AUDIO_MAGIC = (
+    (0, b'RIFF', "wav"),
+    (0, b'OggS', "ogg"),
+    (0, b'fLaC', "flac"),
+    (0, b'ID3', None),
+    (0, b'\x1a\x45\xdf\xa3', "webm"),
+    (4, b'ftyp', "mp4"),
+)
+
 # Global variables
 runner = None
 memory_bank_service = None
 session_service = None
 agent_engine = None
-
-class PersistentState(BaseModel):
+speech_client = None
+vertex_http_client = None
+agent_app_name = None  # persistent app_name, fixed once lifespan has loaded the state
+recognizer = sr.Recognizer()
+
+# In-memory persistent state, written back to PERSISTENCE_FILE at most once per STATE_FLUSH_DELAY.
+# New sessions are appended to PERSISTENCE_LOG and folded into the snapshot every STATE_COMPACT_EVERY
+current_state = None
+state_dirty = False
+state_flush_task = None
+log_appends = 0
+STATE_FLUSH_DELAY = 1.0
+STATE_COMPACT_EVERY = 1000
+
+# Recent memory search results, keyed by (app_name, user_id, normalized query)
+memory_cache = TTLCache(maxsize=2048, ttl=300)
+
+# Number of recalled memories formatted into the agent's context
+MEMORY_TOP_K = 10
+
+# Transcriptions keyed by a hash of the normalized PCM
+transcription_cache = LRUCache(maxsize=1024)
+cache_stats = {"transcription_hits": 0, "transcription_misses": 0}
+
+# Full /process_audio responses keyed by (user_id, session_id, upload digest), so client retries skip STT and the agent
+audio_response_cache = TTLCache(maxsize=1024, ttl=3600)
+
+# Caps concurrent background add_session_to_memory calls
+memory_ingest_semaphore = asyncio.Semaphore(32)
+
+# Audio decoding (ffmpeg, soxr) releases the GIL; a dedicated pool keeps it off the default to_thread executor
+decode_executor = ThreadPoolExecutor(max_workers=os.cpu_count(), thread_name_prefix="audio-decode")
+
+# Internal state, never user input, so a plain dataclass rather than a validated model
+@dataclass(slots=True)
+class PersistentState:
     app_name: str
-    agent_engine_id: Optional[str] = None
     created_at: str
-    sessions: Dict[str, dict] = {}
+    agent_engine_id: Optional[str] = None
+    sessions: Dict[str, dict] = field(default_factory=dict)
 
-def load_persistent_state() -> PersistentState:
-    """Load persistent state from file or create new"""
+def read_persistent_state() -> PersistentState:
+    """Load persistent state from file or create new, then replay the session log"""
     if Path(PERSISTENCE_FILE).exists():
-        with open(PERSISTENCE_FILE, 'r') as f:
-            data = json.load(f)
-            return PersistentState(**data)
+        with open(PERSISTENCE_FILE, 'rb') as f:
+            data = orjson.loads(f.read())
+            state = PersistentState(**data)
     else:
-        return PersistentState(
+        state = PersistentState(
             app_name=APP_NAME,
             created_at=datetime.now().isoformat(),
             sessions={}
         )
+    
+    # A rotated log only survives if we crashed before its snapshot was written
+    for log_path in (PERSISTENCE_LOG + ".old", PERSISTENCE_LOG):
+        if Path(log_path).exists():
+            replay_session_log(state, log_path)
+    return state
+
+def replay_session_log(state: PersistentState, log_path: str):
+    """Apply session records appended since the last snapshot"""
+    with open(log_path, 'rb') as f:
+        for line in f:
+            try:
+                record = orjson.loads(line)
+            except orjson.JSONDecodeError:
+                # Torn final line from a crash mid-append
+                continue
+            state.sessions[record.pop("session_id")] = record
+
+def load_persistent_state() -> PersistentState:
+    """Return the in-memory state, reading it from file on first use"""
+    global current_state
+    if current_state is None:
+        current_state = read_persistent_state()
+    return current_state
+
+def append_session_record(session_id: str, session_info: dict):
+    """Append one new or updated session to the log instead of rewriting the whole snapshot"""
+    global log_appends
+    record = orjson.dumps({"session_id": session_id, **session_info}) + b"\n"
+    fd = os.open(PERSISTENCE_LOG, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+        os.write(fd, record)
+    finally:
+        os.close(fd)
+    
+    log_appends += 1
+    if log_appends >= STATE_COMPACT_EVERY:
+        save_persistent_state(current_state)
+
+def write_persistent_state(data: bytes):
+    """Atomically replace the state file, then drop the log it supersedes"""
+    tmp_path = PERSISTENCE_FILE + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+    os.replace(tmp_path, PERSISTENCE_FILE)
+    
+    if Path(PERSISTENCE_LOG + ".old").exists():
+        os.remove(PERSISTENCE_LOG + ".old")
+
+def pending_state_bytes() -> Optional[bytes]:
+    """Serialize the in-memory state if it has unsaved changes.
+
+    The session log is rotated at the same moment, so records appended while
+    the snapshot is being written land in a fresh log and are not lost.
+    """
+    global state_dirty, log_appends
+    if current_state is None or not (state_dirty or log_appends):
+        return None
+    state_dirty = False
+    
+    if Path(PERSISTENCE_LOG).exists() and not Path(PERSISTENCE_LOG + ".old").exists():
+        os.replace(PERSISTENCE_LOG, PERSISTENCE_LOG + ".old")
+        log_appends = 0
+    return orjson.dumps(current_state, option=orjson.OPT_INDENT_2)
 
 def save_persistent_state(state: PersistentState):
-    """Save persistent state to file"""
-    with open(PERSISTENCE_FILE, 'w') as f:
-        json.dump(state.dict(), f, indent=2)
+    """Mark state as changed and schedule a coalesced write to file"""
+    global state_dirty, state_flush_task
+    state_dirty = True
+    if state_flush_task is None or state_flush_task.done():
+        state_flush_task = asyncio.create_task(flush_persistent_state_later())
+
+async def flush_persistent_state_later():
+    """Wait for further changes to pile up, then write them in one go off the event loop"""
+    await asyncio.sleep(STATE_FLUSH_DELAY)
+    data = pending_state_bytes()
+    if data is not None:
+        await asyncio.to_thread(write_persistent_state, data)
+
+def flush_persistent_state():
+    """Write the in-memory state to file now if it has unsaved changes"""
+    data = pending_state_bytes()
+    if data is not None:
+        write_persistent_state(data)
+
+class PooledSessionService(VertexAiSessionService):
+    """Session service whose per-call Vertex clients share one httpx connection pool.
+
+    ADK builds a fresh client for every session call and closes it on exit.
+    A caller-supplied httpx client is left open by that close, so handing the
+    same one to every client keeps its TLS connections alive across calls.
+    Needs google-adk >= 1.19: earlier releases replace the client's whole
+    http_options with the override, dropping its base_url and api_version.
+    """
+
+    def __init__(self, *args, http_client: httpx.AsyncClient, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._http_options = types.HttpOptions(httpx_async_client=http_client)
+
+    def _api_client_http_options_override(self):
+        return self._http_options
+
+class MemorySearcher:
+    """Front for memory_bank_service.search_memory under concurrent load.
+
+    Non-empty results are cached per (app, user, normalized query) in memory_cache.
+    Identical queries that arrive while a search is already in flight share
+    its result instead of issuing their own RPC, and the number of searches
+    in flight at once is capped.
+    """
+
+    def __init__(self, max_in_flight: int = 50):
+        self._semaphore = asyncio.Semaphore(max_in_flight)
+        self._in_flight: Dict[tuple, asyncio.Future] = {}
+
+    async def search(self, app_name: str, user_id: str, query: str):
+        key = (app_name, user_id, " ".join(query.lower().split()))
+        cached = memory_cache.get(key)
+        if cached is not None:
+            return cached
+        
+        future = self._in_flight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self._search(key, app_name, user_id, query))
+            self._in_flight[key] = future
+            future.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        # Shield so one caller being cancelled doesn't cancel the shared search
+        return await asyncio.shield(future)
+
+    async def _search(self, key: tuple, app_name: str, user_id: str, query: str):
+        async with self._semaphore:
+            memories = await memory_bank_service.search_memory(
+                app_name=app_name,
+                user_id=user_id,
+                query=query
+            )
+        # Empty results aren't cached: memory generation may simply not have finished yet
+        if memories and memories.memories:
+            memory_cache[key] = memories
+        return memories
+
+memory_searcher = MemorySearcher()
 
 # Pydantic models
 class ChatMessage(BaseModel):
@@ -102,71 +328,238 @@ class SessionInfo(BaseModel):
     user_id: str
     created_at: str
 
-def audio_to_text(audio_file_path: str) -> str:
+def sniff_audio_format(header: bytes) -> Tuple[bool, Optional[str]]:
+    """Identify audio from its first bytes as (recognized, ffmpeg format name or None to probe)"""
+    for offset, magic, audio_format in AUDIO_MAGIC:
+        if header[offset:offset + len(magic)] == magic:
+            if audio_format == "wav" and header[8:12] != b'WAVE':
+                continue
+            return True, audio_format
+    
+    # Raw MPEG audio / ADTS AAC frames: 11-bit frame sync, then the layer bits tell them apart
+    if len(header) >= 2 and header[0] == 0xFF and header[1] & 0xE0 == 0xE0:
+        if header[1] & 0x06:
+            return True, "mp3"
+        if header[1] & 0xF0 == 0xF0:
+            return True, "aac"
+    return False, None
+
+def read_pcm_wav(audio_bytes: Union[PcmBuffer, mmap.mmap]) -> Optional[Tuple[int, int, PcmBuffer]]:
+    """Return (sample_rate, channels, data) for a 16-bit PCM WAV, else None"""
+    if len(audio_bytes) < 44 or audio_bytes[0:4] != b'RIFF' or audio_bytes[8:12] != b'WAVE':
+        return None
+    
+    # Walk the RIFF chunks; "fmt " is not always first (JUNK/bext/LIST may precede it)
+    wav_format = None
+    offset = 12
+    while offset + 8 <= len(audio_bytes):
+        chunk_id, chunk_size = struct.unpack('<4sI', audio_bytes[offset:offset + 8])
+        body = offset + 8
+        if chunk_id == b'fmt ':
+            if chunk_size < 16:
+                return None
+            fmt, channels, sample_rate, byte_rate, block_align, bits = struct.unpack('<HHIIHH', audio_bytes[body:body + 16])
+            if fmt != 1 or bits != STT_SAMPLE_WIDTH * 8 or not channels:
+                return None
+            wav_format = (sample_rate, channels)
+        elif chunk_id == b'data':
+            if wav_format is None:
+                return None
+            return (*wav_format, audio_bytes[body:body + chunk_size])
+        offset = body + chunk_size + (chunk_size & 1)
+    return None
+
+def resample_pcm(data: PcmBuffer, sample_rate: int, channels: int) -> bytes:
+    """Downmix and resample 16-bit PCM to the recognizer format in-process with libsoxr"""
+    samples = np.frombuffer(data, dtype=np.int16, count=len(data) // 2)
+    samples = samples[:len(samples) - len(samples) % channels].reshape(-1, channels)
+    samples = samples.mean(axis=1, dtype=np.float32)
+    if sample_rate != STT_SAMPLE_RATE:
+        samples = soxr.resample(samples, sample_rate, STT_SAMPLE_RATE, quality='HQ')
+    return np.clip(np.rint(samples), -32768, 32767).astype(np.int16).tobytes()
+
+def audio_to_pcm(audio_file_path: str, audio_format: Optional[str] = None) -> PcmBuffer:
+    """Decode an audio file to 16 kHz mono 16-bit PCM"""
+    if audio_format == "wav":
+        # Map large files instead of reading them into one big buffer;
+        # only the data chunk slice gets copied out. Small files are read
+        # once and the data chunk is returned as a view, without a copy
+        with open(audio_file_path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size > MMAP_THRESHOLD:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    wav = read_pcm_wav(mapped)
+            else:
+                wav = read_pcm_wav(memoryview(f.read()))
+        
+        if wav is not None:
+            sample_rate, channels, data = wav
+            # Only keep a second past the limit; audio_to_text rejects anything longer
+            data = data[:(MAX_AUDIO_SECONDS + 1) * sample_rate * channels * STT_SAMPLE_WIDTH]
+            if (sample_rate, channels) == (STT_SAMPLE_RATE, 1):
+                return data
+            return resample_pcm(data, sample_rate, channels)
+    
+    # Other containers (and non-16-bit WAV): a single ffmpeg process decodes,
+    # downmixes and resamples straight to raw PCM. Passing the sniffed format
+    # skips ffmpeg's probe; without one it detects the container itself
+    command = [FFMPEG_BINARY, "-nostdin", "-v", "error"]
+    if audio_format:
+        command += ["-f", audio_format]
+    command += [
+        "-i", audio_file_path,
+        "-t", str(MAX_AUDIO_SECONDS + 1),
+        "-ac", "1", "-ar", str(STT_SAMPLE_RATE), "-f", "s16le", "-"
+    ]
+    result = subprocess.run(command, capture_output=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"ffmpeg could not decode audio: {result.stderr.decode(errors='replace').strip()}")
+    return result.stdout
+
+def recognize_google_web(pcm: PcmBuffer) -> str:
+    """Transcribe PCM through the SpeechRecognition web API (fallback path)"""
+    return recognizer.recognize_google(sr.AudioData(bytes(pcm), STT_SAMPLE_RATE, STT_SAMPLE_WIDTH))
+
+async def recognize_streaming(pcm: PcmBuffer) -> str:
+    """Transcribe PCM with Cloud Speech streaming recognition over the shared gRPC channel"""
+    async def requests():
+        yield speech.StreamingRecognizeRequest(streaming_config=STT_STREAMING_CONFIG)
+        for start in range(0, len(pcm), STT_CHUNK_BYTES):
+            yield speech.StreamingRecognizeRequest(audio_content=bytes(pcm[start:start + STT_CHUNK_BYTES]))
+    
+    transcripts = []
+    responses = await speech_client.streaming_recognize(requests=requests())
+    async for response in responses:
+        for result in response.results:
+            if result.is_final and result.alternatives:
+                transcripts.append(result.alternatives[0].transcript.strip())
+    return " ".join(transcripts)
+
+async def audio_to_text(audio_file_path: str, audio_format: Optional[str] = None) -> str:
     """Convert audio file to text using speech recognition"""
     try:
-        recognizer = sr.Recognizer()
-        
-        # Convert audio file to WAV format if needed
-        audio = AudioSegment.from_file(audio_file_path)
-        wav_path = audio_file_path.replace(os.path.splitext(audio_file_path)[1], ".wav")
-        audio.export(wav_path, format="wav")
+        pcm = await asyncio.get_running_loop().run_in_executor(decode_executor, audio_to_pcm, audio_file_path, audio_format)
+        if len(pcm) > MAX_AUDIO_SECONDS * STT_SAMPLE_RATE * STT_SAMPLE_WIDTH:
+            raise HTTPException(status_code=413, detail=f"Audio longer than {MAX_AUDIO_SECONDS} seconds")
         
-        with sr.AudioFile(wav_path) as source:
-            # Adjust for ambient noise and record
-            recognizer.adjust_for_ambient_noise(source)
-            audio_data = recognizer.record(source)
-            
-            # Use Google Speech Recognition
-            text = recognizer.recognize_google(audio_data)
-            print(f"Transcribed text: {text}")
-            return text
+        # Retries and UI refreshes re-send the same clip; answer those without another STT call
+        audio_key = hashlib.blake2b(pcm, digest_size=16).digest()
+        text = transcription_cache.get(audio_key)
+        if text is not None:
+            cache_stats["transcription_hits"] += 1
+        else:
+            cache_stats["transcription_misses"] += 1
+            text = None
+            if speech_client:
+                try:
+                    text = await recognize_streaming(pcm)
+                except (PermissionDenied, Unauthenticated) as e:
+                    # Speech-to-Text API not enabled or not granted for this project
+                    logger.warning("Cloud Speech rejected the request (%s), using web speech recognition", e)
+                else:
+                    if not text:
+                        raise sr.UnknownValueError()
+            if text is None:
+                text = await asyncio.to_thread(recognize_google_web, pcm)
+            transcription_cache[audio_key] = text
+        logger.debug("Transcribed text: %s", text)
+        return text
             
+    except HTTPException:
+        raise
     except sr.UnknownValueError:
         raise HTTPException(status_code=400, detail="Could not understand audio")
-    except sr.RequestError as e:
+    except (sr.RequestError, GoogleAPIError) as e:
         raise HTTPException(status_code=500, detail=f"Speech recognition error: {str(e)}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Audio processing error: {str(e)}")
-    finally:
-        # Clean up temporary files
-        if 'wav_path' in locals() and os.path.exists(wav_path):
-            os.remove(wav_path)
+
+def get_or_create_agent_engine(agent_engine_id: Optional[str]):
+    """Reuse existing agent engine or create new one"""
+    if agent_engine_id:
+        try:
+            print(f"Reusing existing Agent Engine: {agent_engine_id}")
+            agent_engine_name = (
+                f"projects/{PROJECT_ID}/locations/{LOCATION}/reasoningEngines/{agent_engine_id}"
+                if not agent_engine_id.startswith("projects/")
+                else agent_engine_id
+            )
+            return agent_engines.get(agent_engine_name)
+        except Exception as e:
+            print(f"⚠️ Could not reuse engine ({e}), creating new one...")
+            return agent_engines.create()
+    
+    print("Creating new Agent Engine...")
+    return agent_engines.create()
+
+class UploadTooLarge(Exception):
+    pass
+
+class UploadSizeLimitMiddleware:
+    """Answer 413 as soon as a request body passes max_bytes.
+
+    A plain ASGI middleware: it only wraps receive, so requests pay no
+    per-request Request/Response machinery. Declared Content-Length is
+    checked up front; chunked bodies are counted as they arrive, before
+    Starlette spools them to disk.
+    """
+
+    def __init__(self, app, max_bytes: int):
+        self.app = app
+        self.max_bytes = max_bytes
+        self.too_large = ORJSONResponse({"detail": "Audio file too large"}, status_code=413)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        
+        for name, value in scope["headers"]:
+            if name == b"content-length" and value.isdigit() and int(value) > self.max_bytes:
+                return await self.too_large(scope, receive, send)
+        
+        received = 0
+        rejected = False
+        
+        async def limited_receive():
+            nonlocal received, rejected
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes and not rejected:
+                    rejected = True
+                    await self.too_large(scope, receive, send)
+                    raise UploadTooLarge()
+            return message
+        
+        async def guarded_send(message):
+            # Whatever the app makes of the aborted body, the 413 has already been sent
+            if not rejected:
+                await send(message)
+        
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except Exception:
+            # The app may surface the aborted read as its own error; the 413 already answered it
+            if not rejected:
+                raise
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    global runner, memory_bank_service, session_service, agent_engine
+    global runner, memory_bank_service, session_service, agent_engine, speech_client, vertex_http_client, agent_app_name
     
     # Load persistent state
     persistent_state = load_persistent_state()
+    agent_app_name = persistent_state.app_name
     print(f"Loaded persistent state: {persistent_state.app_name}")
     
     print(f"Initializing Agent Engine...")
     print(f"Project: {PROJECT_ID}, Location: {LOCATION}")
 
-    vertexai_client = vertexai.Client(
-        project=PROJECT_ID,
-        location=LOCATION,
+    # Client setup and the engine lookup are independent blocking round trips, overlap them
+    vertexai_client, agent_engine = await asyncio.gather(
+        asyncio.to_thread(vertexai.Client, project=PROJECT_ID, location=LOCATION),
+        asyncio.to_thread(get_or_create_agent_engine, persistent_state.agent_engine_id)
     )
-
-    # Reuse existing agent engine or create new one
-    if persistent_state.agent_engine_id:
-        try:
-            print(f"Reusing existing Agent Engine: {persistent_state.agent_engine_id}")
-            agent_engine_name = (
-                f"projects/{PROJECT_ID}/locations/{LOCATION}/reasoningEngines/{persistent_state.agent_engine_id}"
-                if not persistent_state.agent_engine_id.startswith("projects/")
-                else persistent_state.agent_engine_id
-            )
-            agent_engine = agent_engines.get(agent_engine_name)
-        except Exception as e:
-            print(f"⚠️ Could not reuse engine ({e}), creating new one...")
-            agent_engine = agent_engines.create()
-            persistent_state.agent_engine_id = agent_engine.name
-            save_persistent_state(persistent_state)
-    else:
-        print("Creating new Agent Engine...")
-        agent_engine = agent_engines.create()
+    if agent_engine.name != persistent_state.agent_engine_id:
         persistent_state.agent_engine_id = agent_engine.name
         save_persistent_state(persistent_state)
 
@@ -178,30 +571,44 @@ async def lifespan(app: FastAPI):
         agent_engine_id=agent_engine.name
     )
 
-    session_service = VertexAiSessionService(
+    # Created on the serving loop; every session call reuses its connection pool
+    vertex_http_client = httpx.AsyncClient()
+    session_service = PooledSessionService(
         project=PROJECT_ID, 
         location=LOCATION, 
-        agent_engine_id=agent_engine.name
+        agent_engine_id=agent_engine.name,
+        http_client=vertex_http_client
     )
 
+    # One Cloud Speech client (and gRPC channel) for all transcriptions
+    speech_client = None
+    if speech is None:
+        print("⚠️ google-cloud-speech not installed, falling back to web speech recognition")
+    else:
+        try:
+            speech_client = speech.SpeechAsyncClient()
+        except Exception as e:
+            print(f"⚠️ Cloud Speech unavailable ({e}), falling back to web speech recognition")
+
     # Custom memory retrieval tool (now uses persistent app_name)
     async def recall_past_memories(query: str) -> str:
-        print(f"[Memory Tool] Searching memories for: '{query}'")
+        logger.debug("[Memory Tool] Searching memories for: '%s'", query)
         
         # Search across ALL users or specific user logic
-        memories = await memory_bank_service.search_memory(
-            app_name=persistent_state.app_name,
+        memories = await memory_searcher.search(
+            app_name=agent_app_name,
             user_id="default",
             query=query
         )
         
         if memories and memories.memories:
-            formatted_memories = "\n".join([
+            # Only the top matches go into the prompt
+            formatted_memories = "\n".join(
                 f"- {memory.content.parts[0].text}" 
-                for memory in memories.memories 
+                for memory in memories.memories[:MEMORY_TOP_K] 
                 if memory.content and memory.content.parts
-            ])
-            print(f"Found {len(memories.memories)} relevant memories")
+            )
+            logger.debug("Found %d relevant memories", len(memories.memories))
             return f"Relevant past conversations:\n{formatted_memories}"
         
         return "No relevant past memories found."
@@ -226,14 +633,25 @@ async def lifespan(app: FastAPI):
     yield
     
     print("Shutting down API...")
+    if state_flush_task:
+        await state_flush_task
+    flush_persistent_state()
+    await vertex_http_client.aclose()
+    if speech_client:
+        await speech_client.transport.close()
+    decode_executor.shutdown(wait=False, cancel_futures=True)
 
 app = FastAPI(
     title="Hope Agent API with Audio Processing",
     description="REST API that processes audio input and provides text responses",
     version="2.1.0",
-    lifespan=lifespan
+    lifespan=lifespan,
+    default_response_class=ORJSONResponse
 )
 
+# Added before CORS so CORS stays outermost and the 413 still carries its headers
+app.add_middleware(UploadSizeLimitMiddleware, max_bytes=MAX_UPLOAD_BYTES)
+
 # Enable CORS for all origins (adjust as needed for security)
 app.add_middleware(
     CORSMiddleware,
@@ -243,6 +661,19 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+def new_user_id() -> str:
+    """Generate an anonymous user id (32 hex chars; cheaper and shorter than a uuid4 string)"""
+    return "user_" + secrets.token_hex(16)
+
+NO_TEXT_RESPONSE = "Assistant: (No readable text response)"
+
+def user_content(text: str) -> types.Content:
+    """Build a user message without re-running pydantic validation on known-good fields"""
+    return types.Content.model_construct(
+        role="user",
+        parts=[types.Part.model_construct(text=text)]
+    )
+
 async def run_single_turn(query: str, session_id: str, user_id: str) -> str:
     """Run a single conversation turn"""
     global runner
@@ -250,16 +681,21 @@ async def run_single_turn(query: str, session_id: str, user_id: str) -> str:
     if not runner:
         raise HTTPException(status_code=503, detail="Agent runner not initialized")
     
-    content = types.Content(role="user", parts=[types.Part(text=query)])
-    events = runner.run(user_id=user_id, session_id=session_id, new_message=content)
+    # run_async keeps the turn on the event loop instead of blocking it
+    events = runner.run_async(user_id=user_id, session_id=session_id, new_message=user_content(query))
 
-    for event in events:
-        if event.is_final_response():
-            for part in event.content.parts:
-                if hasattr(part, 'text') and part.text:
-                    return part.text
+    try:
+        async for event in events:
+            if event.is_final_response():
+                return next(
+                    (part.text for part in event.content.parts if getattr(part, 'text', None)),
+                    NO_TEXT_RESPONSE
+                )
+    finally:
+        # Close the generator now rather than leaving it (and its events) for GC
+        await events.aclose()
     
-    return "Assistant: (No readable text response)"
+    return NO_TEXT_RESPONSE
 
 async def create_new_session(user_id: str) -> str:
     """Create a new session and persist it"""
@@ -267,19 +703,50 @@ async def create_new_session(user_id: str) -> str:
     persistent_state = load_persistent_state()
     
     session = await session_service.create_session(
-        app_name=persistent_state.app_name,
+        app_name=agent_app_name,
         user_id=user_id,
     )
     
     # Persist session info
-    persistent_state.sessions[session.id] = {
+    session_info = {
         "user_id": user_id,
         "created_at": datetime.now().isoformat()
     }
-    save_persistent_state(persistent_state)
+    persistent_state.sessions[session.id] = session_info
+    append_session_record(session.id, session_info)
     
     return session.id
 
+async def ensure_session(session_id: Optional[str], user_id: str) -> str:
+    """Return session_id if it is a known session, otherwise create a new one"""
+    persistent_state = load_persistent_state()
+    
+    if session_id and session_id in persistent_state.sessions:
+        return session_id
+    return await create_new_session(user_id)
+
+async def save_session_to_memory(session_id: str, user_id: str):
+    """Add a finished session's conversation to the memory bank (runs as a background task)"""
+    async with memory_ingest_semaphore:
+        try:
+            session = await session_service.get_session(
+                app_name=agent_app_name,
+                user_id=user_id,
+                session_id=session_id
+            )
+            await memory_bank_service.add_session_to_memory(session)
+        except Exception as e:
+            logger.warning("Could not save session %s to memory (%s)", session_id, e)
+            # Let a later /end call retry it
+            session_info = load_persistent_state().sessions[session_id]
+            session_info.pop("saved_to_memory", None)
+            append_session_record(session_id, session_info)
+            return
+    
+    # Searches cached before this session was ingested may now be stale
+    for key in [k for k in memory_cache.keys() if k[1] == user_id]:
+        memory_cache.pop(key, None)
+
 @app.post("/chat", response_model=ChatResponse)
 async def chat(chat_message: ChatMessage, background_tasks: BackgroundTasks):
     """Send a message to the agent with memory recall"""
@@ -289,7 +756,7 @@ async def chat(chat_message: ChatMessage, background_tasks: BackgroundTasks):
         raise HTTPException(status_code=503, detail="Agent runner not initialized")
     
     persistent_state = load_persistent_state()
-    user_id = chat_message.user_id or f"user_{uuid.uuid4()}"
+    user_id = chat_message.user_id or new_user_id()
     
     # Create new session or use existing one
     if chat_message.session_id:
@@ -327,28 +794,37 @@ async def process_audio(
     if not runner:
         raise HTTPException(status_code=503, detail="Agent runner not initialized")
     
-    # Validate file type
-    if not file.content_type.startswith('audio/'):
+    # Validate file type from its magic bytes; clients often mislabel uploads.
+    # Containers the table doesn't know (AIFF, CAF, AMR, WMA, ...) are still
+    # accepted when labelled audio/*, and ffmpeg detects their format itself
+    header = await file.read(16)
+    recognized, audio_format = sniff_audio_format(header)
+    if not recognized and not (file.content_type or "").startswith("audio/"):
         raise HTTPException(status_code=400, detail="File must be an audio file")
     
     # Save uploaded file temporarily
+    upload_digest = hashlib.blake2b(header, digest_size=16)
     with tempfile.NamedTemporaryFile(delete=False, suffix=os.path.splitext(file.filename)[1]) as temp_file:
         temp_path = temp_file.name
-        content = await file.read()
-        temp_file.write(content)
+        temp_file.write(header)
+        # Stream the upload to disk in chunks instead of buffering it whole
+        while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+            temp_file.write(chunk)
+            upload_digest.update(chunk)
     
     try:
-        # Convert audio to text
-        transcription = audio_to_text(temp_path)
-        
-        persistent_state = load_persistent_state()
+        # Without a session_id every request starts a new session, so only retries into a known session can be replayed
+        retry_key = (user_id, session_id, upload_digest.digest()) if session_id else None
+        if retry_key:
+            cached_response = audio_response_cache.get(retry_key)
+            if cached_response is not None:
+                return cached_response
         
-        # Create new session or use existing one
-        if not session_id:
-            session_id = await create_new_session(user_id)
-        else:
-            if session_id not in persistent_state.sessions:
-                session_id = await create_new_session(user_id)
+        # Transcription and session lookup are independent, run them together
+        transcription, session_id = await asyncio.gather(
+            audio_to_text(temp_path, audio_format),
+            ensure_session(session_id, user_id)
+        )
         
         # Get agent response
         response_text = await run_single_turn(
@@ -357,13 +833,18 @@ async def process_audio(
             user_id=user_id
         )
         
-        return AudioResponse(
+        response = AudioResponse(
             transcription=transcription,
             response=response_text,
             session_id=session_id,
             user_id=user_id
         )
+        if retry_key:
+            audio_response_cache[retry_key] = response
+        return response
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing audio: {str(e)}")
     finally:
@@ -374,11 +855,8 @@ async def process_audio(
 @app.get("/memory/search")
 async def search_memory(query: str, user_id: str = "default"):
     """Directly search memory bank"""
-    global memory_bank_service
-    persistent_state = load_persistent_state()
-    
-    memories = await memory_bank_service.search_memory(
-        app_name=persistent_state.app_name,
+    memories = await memory_searcher.search(
+        app_name=agent_app_name,
         user_id=user_id,
         query=query
     )
@@ -398,7 +876,7 @@ async def search_memory(query: str, user_id: str = "default"):
 @app.post("/sessions/new", response_model=ChatResponse)
 async def create_session(user_id: Optional[str] = None):
     """Create a new chat session"""
-    user_id = user_id or f"user_{uuid.uuid4()}"
+    user_id = user_id or new_user_id()
     session_id = await create_new_session(user_id)
     
     return ChatResponse(
@@ -407,12 +885,51 @@ async def create_session(user_id: Optional[str] = None):
         user_id=user_id
     )
 
+@app.post("/sessions/{session_id}/end")
+async def end_session(session_id: str, background_tasks: BackgroundTasks):
+    """Add a finished session to the memory bank, once per session"""
+    persistent_state = load_persistent_state()
+    session_info = persistent_state.sessions.get(session_id)
+    if session_info is None:
+        raise HTTPException(status_code=404, detail="Session not found")
+    
+    if session_info.get("saved_to_memory"):
+        return {"session_id": session_id, "status": "already saved"}
+    
+    # Marked up front so repeated /end calls don't submit the same events again
+    session_info["saved_to_memory"] = True
+    append_session_record(session_id, session_info)
+    background_tasks.add_task(save_session_to_memory, session_id, session_info["user_id"])
+    return {"session_id": session_id, "status": "saving"}
+
 @app.get("/sessions")
 async def list_sessions():
     """List all persisted sessions"""
     persistent_state = load_persistent_state()
     return persistent_state.sessions
 
+@app.get("/cache/stats")
+async def get_cache_stats():
+    """Report in-process cache usage"""
+    lookups = cache_stats["transcription_hits"] + cache_stats["transcription_misses"]
+    return {
+        "transcriptions": {
+            "size": len(transcription_cache),
+            "max_size": transcription_cache.maxsize,
+            "hits": cache_stats["transcription_hits"],
+            "misses": cache_stats["transcription_misses"],
+            "hit_rate": cache_stats["transcription_hits"] / lookups if lookups else 0.0
+        },
+        "memory_searches": {
+            "size": len(memory_cache),
+            "max_size": memory_cache.maxsize
+        },
+        "audio_responses": {
+            "size": len(audio_response_cache),
+            "max_size": audio_response_cache.maxsize
+        }
+    }
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file